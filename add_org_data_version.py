@@ -0,0 +1,115 @@
+import asyncio
+from sqlalchemy import text
+from database import engine
+
+# Schema for the per-org data version behind the employee listing ETags.
+# Employees are also loaded outside the app, so the version is maintained by
+# Postgres triggers rather than ORM events. Runs on app startup (main.py) and can
+# also be run by hand: `python add_org_data_version.py`. Safe to re-run.
+
+# Serialises setup across instances that start at the same time
+SETUP_LOCK_ID = 720_280_001
+LEGACY_TRIGGER = "employees_bump_org_data_version"
+
+BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION bump_org_data_version() RETURNS trigger AS $$
+DECLARE
+    changed_org INTEGER;
+BEGIN
+    -- TRUNCATE fires no row-level data, so every org's listing may have changed
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE organizations SET data_version = data_version + 1;
+        RETURN NULL;
+    END IF;
+
+    -- Bump each affected org once per statement, in id order so concurrent
+    -- writers touching several orgs always lock them in the same order
+    IF TG_OP = 'INSERT' THEN
+        FOR changed_org IN SELECT DISTINCT org_id FROM new_rows ORDER BY org_id LOOP
+            UPDATE organizations SET data_version = data_version + 1 WHERE id = changed_org;
+        END LOOP;
+    ELSIF TG_OP = 'UPDATE' THEN
+        FOR changed_org IN
+            SELECT org_id FROM new_rows UNION SELECT org_id FROM old_rows ORDER BY 1
+        LOOP
+            UPDATE organizations SET data_version = data_version + 1 WHERE id = changed_org;
+        END LOOP;
+    ELSIF TG_OP = 'DELETE' THEN
+        FOR changed_org IN SELECT DISTINCT org_id FROM old_rows ORDER BY org_id LOOP
+            UPDATE organizations SET data_version = data_version + 1 WHERE id = changed_org;
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Transition tables are only allowed on single-event triggers, hence one per operation
+TRIGGERS = {
+    "employees_org_version_insert": (
+        "AFTER INSERT ON employees REFERENCING NEW TABLE AS new_rows"
+    ),
+    "employees_org_version_update": (
+        "AFTER UPDATE ON employees REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"
+    ),
+    "employees_org_version_delete": (
+        "AFTER DELETE ON employees REFERENCING OLD TABLE AS old_rows"
+    ),
+    "employees_org_version_truncate": "AFTER TRUNCATE ON employees",
+}
+
+async def _existing_state(conn) -> tuple:
+    result = await conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'organizations' "
+        "AND column_name = 'data_version'"
+    ))
+    has_column = result.first() is not None
+    result = await conn.execute(text(
+        "SELECT tgname FROM pg_trigger WHERE tgrelid = to_regclass('employees') AND NOT tgisinternal"
+    ))
+    return has_column, set(result.scalars().all())
+
+async def org_data_version_ready(conn) -> bool:
+    """True if the column and every bump trigger exist, i.e. ETags will be invalidated."""
+    has_column, triggers = await _existing_state(conn)
+    return has_column and set(TRIGGERS) <= triggers
+
+async def ensure_org_data_version(conn) -> None:
+    """
+    Create whatever is missing. Only reads the catalog when everything is
+    already in place, so routine restarts take no locks on employees.
+    """
+    has_column, triggers = await _existing_state(conn)
+    if has_column and set(TRIGGERS) <= triggers and LEGACY_TRIGGER not in triggers:
+        return
+
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SETUP_LOCK_ID})
+    # Another instance may have finished setup while we waited for the lock
+    has_column, triggers = await _existing_state(conn)
+
+    if not has_column:
+        await conn.execute(text(
+            "ALTER TABLE organizations ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0;"
+        ))
+    # Superseded per-row trigger from an earlier version of this feature
+    if LEGACY_TRIGGER in triggers:
+        await conn.execute(text(f"DROP TRIGGER {LEGACY_TRIGGER} ON employees;"))
+
+    missing = [name for name in TRIGGERS if name not in triggers]
+    if missing:
+        await conn.execute(text(BUMP_FUNCTION))
+    for name in missing:
+        await conn.execute(text(
+            f"CREATE TRIGGER {name} {TRIGGERS[name]} "
+            "FOR EACH STATEMENT EXECUTE FUNCTION bump_org_data_version();"
+        ))
+
+async def main():
+    async with engine.begin() as conn:
+        await ensure_org_data_version(conn)
+        ready = await org_data_version_ready(conn)
+    print("Done" if ready else "Incomplete: ETags will stay disabled")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,242 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+# ── Admission config ──────────────────────────────────────────────────────────
+# Pipelines allowed to run at once across all orgs
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 4))
+# Waiting requests allowed in total, and per org, before we start returning 429
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", 32))
+AI_MAX_QUEUE_PER_ORG = int(os.getenv("AI_MAX_QUEUE_PER_ORG", 8))
+# Longest a request may wait for a slot (seconds)
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", 10))
+
+def parse_org_weights(raw: str) -> dict:
+    """Parse "org_id:weight,..." into a dict, rejecting malformed pairs and weights <= 0."""
+    weights = {}
+    for pair in raw.split(","):
+        if not pair.strip():
+            continue
+        try:
+            org, weight = pair.split(":")
+            org_id, value = int(org), float(weight)
+        except ValueError:
+            raise RuntimeError(
+                f"FATAL: Invalid AI_ORG_WEIGHTS entry {pair.strip()!r}; expected 'org_id:weight'."
+            )
+        if not value > 0 or math.isinf(value):
+            raise RuntimeError(
+                f"FATAL: AI_ORG_WEIGHTS weight for org {org_id} must be a positive number, got {weight.strip()!r}."
+            )
+        weights[org_id] = value
+    return weights
+
+
+# Optional per-org weights, e.g. "1:2,7:3". Orgs not listed get weight 1.
+AI_ORG_WEIGHTS = parse_org_weights(os.getenv("AI_ORG_WEIGHTS", ""))
+
+
+class QueueRejected(Exception):
+    """The request could not be admitted (queue full or waited too long)."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class FairAdmissionController:
+    """
+    Global concurrency limit with per-org weighted fair queueing.
+
+    When all slots are busy, waiters are ordered by virtual finish time
+    (start + 1/weight, where start is the later of the global virtual clock and
+    the org's previous finish). An org that floods the queue pushes its own
+    finish times further out, so other orgs' requests are interleaved ahead of it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        max_queue_per_org: int,
+        queue_timeout: float,
+        weights: dict | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_org = max_queue_per_org
+        self.queue_timeout = queue_timeout
+        self.weights = weights or {}
+
+        self.active = 0
+        self._heap = []  # (finish, seq, org_id, future)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: dict = {}
+        self._queued_per_org: dict = {}
+
+        # Metrics
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.abandoned_wait_count = 0
+        self.abandoned_wait_total = 0.0
+
+    # ── Queue bookkeeping ─────────────────────────────────────────────────────
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued_per_org.values())
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    def _enqueue(self, org_id) -> tuple:
+        weight = self.weights.get(org_id, 1.0)
+        start = max(self._virtual_time, self._last_finish.get(org_id, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[org_id] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._seq), org_id, future))
+        self._queued_per_org[org_id] = self._queued_per_org.get(org_id, 0) + 1
+        return finish, future
+
+    def _withdraw(self, org_id, finish: float, future: asyncio.Future) -> None:
+        """
+        Remove a waiter that gave up without being served and refund its virtual
+        cost, so the org is not charged for work that never ran. The org's later
+        waiters were stacked on top of this one and move up by the same amount.
+        """
+        cost = 1.0 / self.weights.get(org_id, 1.0)
+        heap = []
+        for entry in self._heap:
+            entry_finish, seq, entry_org, entry_future = entry
+            if entry_future is future:
+                continue
+            if entry_org == org_id and entry_finish > finish:
+                entry = (entry_finish - cost, seq, entry_org, entry_future)
+            heap.append(entry)
+        heapq.heapify(heap)
+        self._heap = heap
+        self._last_finish[org_id] = self._last_finish.get(org_id, finish) - cost
+        self._dequeued(org_id)
+
+    def _dequeued(self, org_id) -> None:
+        remaining = self._queued_per_org.get(org_id, 0) - 1
+        if remaining > 0:
+            self._queued_per_org[org_id] = remaining
+        else:
+            self._queued_per_org.pop(org_id, None)
+
+    def _record_wait(self, waited: float) -> None:
+        self.wait_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    # ── Acquire / release ─────────────────────────────────────────────────────
+    async def acquire(self, org_id) -> None:
+        if self.active < self.max_concurrency and self.queue_depth == 0:
+            self.active += 1
+            self.admitted += 1
+            self._record_wait(0.0)
+            return
+
+        if (
+            self.queue_depth >= self.max_queue
+            or self._queued_per_org.get(org_id, 0) >= self.max_queue_per_org
+        ):
+            self.rejected_full += 1
+            raise QueueRejected("AI analysis queue is full", self._retry_after())
+
+        enqueued_at = time.monotonic()
+        finish, future = self._enqueue(org_id)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if future.done() and not future.cancelled():
+                # Granted a slot at the same moment we gave up: hand it on
+                self.release()
+            else:
+                future.cancel()
+                self._withdraw(org_id, finish, future)
+            self.abandoned_wait_count += 1
+            self.abandoned_wait_total += time.monotonic() - enqueued_at
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            self.rejected_timeout += 1
+            raise QueueRejected("Timed out waiting for an AI analysis slot", self._retry_after())
+
+        self.admitted += 1
+        self._record_wait(time.monotonic() - enqueued_at)
+
+    def release(self) -> None:
+        while self._heap:
+            finish, _, org_id, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+            # Slot passes straight to the waiter; `active` stays the same
+            self._virtual_time = max(self._virtual_time, finish)
+            self._dequeued(org_id)
+            future.set_result(None)
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, org_id):
+        """Hold a pipeline slot for the duration of the block, or raise 429."""
+        try:
+            await self.acquire(org_id)
+        except QueueRejected as exc:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=exc.reason,
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self, org_id=None) -> dict:
+        """
+        Aggregate admission metrics. Per-org detail is only ever reported for
+        the given org, so callers never see other tenants' queueing.
+        """
+        metrics = {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queue_depth": self.queue_depth,
+            "admitted_total": self.admitted,
+            "rejected_queue_full_total": self.rejected_full,
+            "rejected_timeout_total": self.rejected_timeout,
+            "wait_seconds_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            "wait_seconds_max": self.wait_max,
+            # Waits that ended in a timeout or client disconnect rather than a slot
+            "abandoned_wait_total": self.abandoned_wait_count,
+            "abandoned_wait_seconds_avg": (
+                self.abandoned_wait_total / self.abandoned_wait_count
+                if self.abandoned_wait_count else 0.0
+            ),
+        }
+        if org_id is not None:
+            metrics["org_queue_depth"] = self._queued_per_org.get(org_id, 0)
+        return metrics
+
+
+ai_admission = FairAdmissionController(
+    max_concurrency=AI_MAX_CONCURRENCY,
+    max_queue=AI_MAX_QUEUE,
+    max_queue_per_org=AI_MAX_QUEUE_PER_ORG,
+    queue_timeout=AI_QUEUE_TIMEOUT,
+    weights=AI_ORG_WEIGHTS,
+)
@@ -1,5 +1,8 @@
 import os
 import json
+import math
+import time
+import asyncio
 import httpx
 
 from fastapi import APIRouter, Depends, HTTPException, status
@@ -7,6 +10,7 @@ from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from admission import ai_admission
 from database import get_db
 from models import Employee
 from security import get_current_user
@@ -15,19 +19,114 @@ ai_router = APIRouter()
 
 # ── OpenRouter config ────────────────────────────────────────────────────────
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-OPENROUTER_MODEL = "openrouter/free"
+# Overridable so the resilience logic can be exercised against a local fake upstream
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+def parse_models(raw: str) -> list:
+    """Parse a comma-separated model list, rejecting an empty one."""
+    models = [m.strip() for m in raw.split(",") if m.strip()]
+    if not models:
+        raise RuntimeError(
+            f"FATAL: OPENROUTER_MODELS must list at least one model, got {raw!r}."
+        )
+    return models
+
+
+# Ordered fallback list, e.g. "openrouter/free,meta-llama/llama-3.1-8b-instruct:free"
+OPENROUTER_MODELS = parse_models(os.getenv("OPENROUTER_MODELS", "openrouter/free"))
+OPENROUTER_MODEL = OPENROUTER_MODELS[0]
+
+# Per-attempt upstream timeout (seconds)
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", 30))
+# Fire a duplicate request if the first has not answered after this delay (roughly
+# the upstream p95). Set to 0 to disable hedging.
+OPENROUTER_HEDGE_DELAY = float(os.getenv("OPENROUTER_HEDGE_DELAY", 4))
+# Circuit breaker: open after this many consecutive failures, retry after the cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("OPENROUTER_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("OPENROUTER_BREAKER_RESET", 30))
 
 # ── Request body ─────────────────────────────────────────────────────────────
 class AnalyseRequest(BaseModel):
     prompt: str
 
 
+# ── Resilience helpers ────────────────────────────────────────────────────────
+class UpstreamError(Exception):
+    """A single OpenRouter attempt failed transiently (network error, timeout, 429, 5xx, bad body)."""
+
+
+class UpstreamRejected(Exception):
+    """OpenRouter rejected the request itself (4xx other than 429); retrying cannot help."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream model.
+
+    closed    → calls go through; failures are counted.
+    open      → calls are rejected immediately until the cooldown elapses.
+    half-open → one trial call is let through; success closes, failure re-opens.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        """Whole seconds until the cooldown ends (at least 1)."""
+        if self.opened_at is None:
+            return 1
+        remaining = self.opened_at + self.reset_seconds - time.monotonic()
+        return max(1, math.ceil(remaining))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def _get_breaker(model: str) -> CircuitBreaker:
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        _breakers[model] = breaker
+    return breaker
+
+
 # ── Internal helpers ──────────────────────────────────────────────────────────
-def _build_payload(system_instruction: str, user_message: str) -> dict:
+def _build_payload(system_instruction: str, user_message: str, model: str = OPENROUTER_MODEL) -> dict:
     """Build an OpenRouter (OpenAI-compatible) chat completions request body."""
     return {
-        "model": OPENROUTER_MODEL,
+        "model": model,
         "messages": [
             {"role": "system", "content": system_instruction},
             {"role": "user", "content": user_message},
@@ -36,37 +135,136 @@ def _build_payload(system_instruction: str, user_message: str) -> dict:
     }
 
 
+def _make_client() -> httpx.AsyncClient:
+    """HTTP client for OpenRouter calls; tests swap this for a fake upstream."""
+    return httpx.AsyncClient(timeout=OPENROUTER_TIMEOUT)
+
+
+async def _post_once(client: httpx.AsyncClient, payload: dict, headers: dict) -> str:
+    """Make a single OpenRouter request and return the message text."""
+    try:
+        # httpx timeouts are per phase; this bounds the whole attempt, including
+        # a response body that trickles in slowly
+        response = await asyncio.wait_for(
+            client.post(OPENROUTER_URL, json=payload, headers=headers),
+            timeout=OPENROUTER_TIMEOUT,
+        )
+    except asyncio.TimeoutError as exc:
+        raise UpstreamError(f"Timed out after {OPENROUTER_TIMEOUT}s") from exc
+    except httpx.HTTPError as exc:
+        raise UpstreamError(f"{type(exc).__name__}: {exc}") from exc
+
+    if response.status_code != 200:
+        message = f"OpenRouter API error {response.status_code}: {response.text}"
+        if response.status_code == 429 or response.status_code >= 500:
+            raise UpstreamError(message)
+        # Request-specific (e.g. 400/413/422 from an oversized prompt): not the model's fault
+        raise UpstreamRejected(message)
+
+    try:
+        return response.json()["choices"][0]["message"]["content"].strip()
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as exc:
+        raise UpstreamError(f"Unexpected OpenRouter response structure: {exc!r}") from exc
+
+
+async def _hedged_post(client: httpx.AsyncClient, payload: dict, headers: dict) -> str:
+    """
+    Send the request and, if it is still pending after OPENROUTER_HEDGE_DELAY,
+    send an identical one. The first successful answer wins and the other is
+    cancelled. Fails only if every attempt fails; UpstreamRejected is raised
+    straight away without hedging.
+    """
+    pending = {asyncio.create_task(_post_once(client, payload, headers))}
+    hedged = OPENROUTER_HEDGE_DELAY <= 0
+    last_error = None
+
+    try:
+        while pending:
+            timeout = None if hedged else OPENROUTER_HEDGE_DELAY
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                try:
+                    return task.result()
+                except UpstreamError as exc:
+                    last_error = exc
+            # Hedge on slowness or on an early failure of the first attempt
+            if not hedged:
+                hedged = True
+                pending.add(asyncio.create_task(_post_once(client, payload, headers)))
+    finally:
+        for task in pending:
+            task.cancel()
+        # Let the losers unwind before the shared client closes or the next model starts
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    raise last_error
+
+
 async def _call_ai(system_instruction: str, user_message: str) -> str:
-    """Call the OpenRouter API and return the raw text response."""
+    """
+    Call the OpenRouter API and return the raw text response.
+
+    Models in OPENROUTER_MODELS are tried in order. Each attempt is hedged and
+    guarded by a per-model circuit breaker, so an outage fails fast instead of
+    stalling every request.
+    """
     if not OPENROUTER_API_KEY:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="OPENROUTER_API_KEY is not configured in the environment.",
         )
 
-    payload = _build_payload(system_instruction, user_message)
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
     }
-
-    async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.post(OPENROUTER_URL, json=payload, headers=headers)
-
-    if response.status_code != 200:
+    errors = []
+    rejected = []
+
+    async with _make_client() as client:
+        for model in OPENROUTER_MODELS:
+            breaker = _get_breaker(model)
+            if not breaker.allow():
+                rejected.append(breaker)
+                errors.append(f"{model}: circuit open")
+                continue
+
+            payload = _build_payload(system_instruction, user_message, model)
+            try:
+                text = await _hedged_post(client, payload, headers)
+            except UpstreamError as exc:
+                breaker.record_failure()
+                errors.append(f"{model}: {exc}")
+                continue
+            except UpstreamRejected as exc:
+                # The model answered; the request was bad. No fallback, no breaker penalty.
+                breaker.trial_in_flight = False
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=str(exc),
+                )
+            except BaseException:
+                # Cancelled mid-flight: release a half-open trial slot without judging the model
+                breaker.trial_in_flight = False
+                raise
+
+            breaker.record_success()
+            return text
+
+    # Every model was short-circuited (open, or its half-open trial is taken)
+    if len(rejected) == len(OPENROUTER_MODELS):
+        retry_after = min(breaker.retry_after() for breaker in rejected)
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"OpenRouter API error {response.status_code}: {response.text}",
-        )
-
-    data = response.json()
-    try:
-        return data["choices"][0]["message"]["content"].strip()
-    except (KeyError, IndexError) as exc:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Unexpected OpenRouter response structure: {exc}",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI provider is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(retry_after)},
         )
+    raise HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail="All OpenRouter models failed: " + "; ".join(errors),
+    )
 
 
 # ── System prompts ─────────────────────────────────────────────────────────────
@@ -168,62 +366,77 @@ async def analyse(
             detail="Only HR users can use the AI analysis endpoint.",
         )
 
-    # ── Stage 1: Classification ───────────────────────────────────────────────
-    classification = await _call_ai(
-        system_instruction=CLASSIFIER_SYSTEM_PROMPT,
-        user_message=body.prompt,
-    )
-
-    if classification != "Yes":
-        return {"result": classification}
-
-    # ── Stage 2: Fetch employee id + summary for the org ─────────────────────
-    result = await db.execute(
-        select(Employee.employee_id, Employee.summary).where(
-            Employee.org_id == current_user.org_id
-        ).limit(10)
-    )
-    rows = result.all()
-
-    if not rows:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No employees found for your organisation.",
+    # Bound concurrent pipelines; each org queues fairly for a slot and gets
+    # a 429 with Retry-After if the queue is saturated.
+    async with ai_admission.slot(current_user.org_id):
+        # ── Stage 1: Classification ───────────────────────────────────────────
+        classification = await _call_ai(
+            system_instruction=CLASSIFIER_SYSTEM_PROMPT,
+            user_message=body.prompt,
         )
 
-    employee_array = [
-        {"employee_id": row.employee_id, "summary": row.summary or ""}
-        for row in rows
-    ]
-
-    # ── Stage 3: Risk scoring ─────────────────────────────────────────────────
-    # Prefix the user's exact query as CONDITION so the model scores specifically for it
-    scoring_input = (
-        f"CONDITION: {body.prompt}\n"
-        f"DATA:\n"
-        f"{json.dumps(employee_array, ensure_ascii=False)}"
-    )
+        if classification != "Yes":
+            return {"result": classification}
 
-    raw_scores = await _call_ai(
-        system_instruction=RISK_SCORING_SYSTEM_PROMPT,
-        user_message=scoring_input,
-    )
+        # ── Stage 2: Fetch employee id + summary for the org ─────────────────
+        result = await db.execute(
+            select(Employee.employee_id, Employee.summary).where(
+                Employee.org_id == current_user.org_id
+            ).limit(10)
+        )
+        rows = result.all()
+
+        if not rows:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No employees found for your organisation.",
+            )
+
+        employee_array = [
+            {"employee_id": row.employee_id, "summary": row.summary or ""}
+            for row in rows
+        ]
+
+        # ── Stage 3: Risk scoring ─────────────────────────────────────────────
+        # Prefix the user's exact query as CONDITION so the model scores specifically for it
+        scoring_input = (
+            f"CONDITION: {body.prompt}\n"
+            f"DATA:\n"
+            f"{json.dumps(employee_array, ensure_ascii=False)}"
+        )
 
-    # Parse the JSON the model returns
-    try:
-        # Strip any accidental markdown fences the model may include
-        clean = (
-            raw_scores.strip()
-            .removeprefix("```json")
-            .removeprefix("```")
-            .removesuffix("```")
-            .strip()
+        raw_scores = await _call_ai(
+            system_instruction=RISK_SCORING_SYSTEM_PROMPT,
+            user_message=scoring_input,
         )
-        scores = json.loads(clean)
-    except json.JSONDecodeError as exc:
+
+        # Parse the JSON the model returns
+        try:
+            # Strip any accidental markdown fences the model may include
+            clean = (
+                raw_scores.strip()
+                .removeprefix("```json")
+                .removeprefix("```")
+                .removesuffix("```")
+                .strip()
+            )
+            scores = json.loads(clean)
+        except json.JSONDecodeError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"OpenRouter returned invalid JSON for risk scores: {exc}",
+            )
+
+        return scores
+
+
+@ai_router.get("/metrics")
+async def admission_metrics(user_and_role: tuple = Depends(get_current_user)):
+    """Admission metrics for /analyse; per-org detail only for the caller's own org."""
+    current_user, role = user_and_role
+    if role != "hr":
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"OpenRouter returned invalid JSON for risk scores: {exc}",
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only HR users can view AI metrics.",
         )
-
-    return scores
+    return ai_admission.metrics(org_id=current_user.org_id)
@@ -1,16 +1,62 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi import APIRouter, Depends, Query, HTTPException, status, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, Float, cast
 from typing import Optional
 from database import get_db
-from models import Employee, HR
+from models import Employee, HR, Org
 import datetime
+import hashlib
 from security import get_current_user
 
 filter_router = APIRouter()
 
+async def _org_etag(db: AsyncSession, org_id: int, *params) -> str:
+    """Weak ETag for an org's employee listing: per-org data version plus the query params."""
+    result = await db.execute(select(Org.data_version).where(Org.id == org_id))
+    version = result.scalar() or 0
+    params_hash = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+    return f'W/"{org_id}-{version}-{params_hash}"'
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as per RFC 9110 for If-None-Match
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def _set_cache_headers(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    # Let browsers keep the body but always revalidate with If-None-Match
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def _not_modified_response(etag: str) -> Response:
+    # A 304 must carry the same cache headers the 200 would have (RFC 9110 §15.4.5)
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    _set_cache_headers(response, etag)
+    return response
+
+async def _conditional_get(
+    request: Request, response: Response, db: AsyncSession, org_id: int, *params
+) -> Optional[Response]:
+    """
+    Return a 304 if the client's copy is current, else tag `response` and return None.
+    Does nothing unless startup confirmed the data-version triggers exist.
+    """
+    if not getattr(request.app.state, "etags_enabled", False):
+        return None
+    etag = await _org_etag(db, org_id, *params)
+    if _not_modified(request, etag):
+        return _not_modified_response(etag)
+    _set_cache_headers(response, etag)
+    return None
+
 @filter_router.get("/employees")
 async def filter_employees(
+    request: Request,
+    response: Response,
     gender: Optional[str] = Query(None, description="Filter by gender (e.g., 'M', 'F')"),
     department: Optional[str] = Query(None, description="Filter by department"),
     age: Optional[int] = Query(None, description="Exact age"),
@@ -32,6 +78,15 @@ async def filter_employees(
         # If there are other roles without org_id access, block them or handle accordingly
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only HR users can filter employees")
 
+    # Skip the query entirely if the client already has this exact result.
+    # Age filters depend on today's date, so the date is part of the tag.
+    not_modified = await _conditional_get(
+        request, response, db, current_user.org_id, "filter", datetime.date.today().isoformat(),
+        gender, department, age, min_age, max_age, weight, min_weight, max_weight,
+    )
+    if not_modified:
+        return not_modified
+
     
     # 1. Gender
     if gender:
@@ -86,6 +141,8 @@ async def filter_employees(
 
 @filter_router.get("/employees/all")
 async def get_all_employees(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     user_and_role: tuple = Depends(get_current_user)
 ):
@@ -94,6 +151,10 @@ async def get_all_employees(
     # Check if the user is an HR
     if role != "hr":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only HR users can access this endpoint")
+
+    not_modified = await _conditional_get(request, response, db, current_user.org_id, "all")
+    if not_modified:
+        return not_modified
         
     query = select(Employee).where(Employee.org_id == current_user.org_id)
     result = await db.execute(query)
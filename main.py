@@ -4,6 +4,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from auth import auth_router
 from filter_service import filter_router
 from ai_service import ai_router
+from add_org_data_version import ensure_org_data_version, org_data_version_ready
+import logging
 
 app = FastAPI()
 app.add_middleware(
@@ -12,6 +14,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 @app.get("/")
@@ -23,6 +26,18 @@ async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # Employee listing ETags are only safe once the data-version triggers exist;
+    # otherwise clients would get 304s that are never invalidated.
+    try:
+        async with engine.begin() as conn:
+            await ensure_org_data_version(conn)
+    except Exception:
+        logging.exception("Could not set up organization data versions")
+    async with engine.connect() as conn:
+        app.state.etags_enabled = await org_data_version_ready(conn)
+    if not app.state.etags_enabled:
+        logging.warning("Organization data-version triggers missing; employee listing ETags disabled")
+
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(filter_router, prefix="/filter", tags=["filter"])
 app.include_router(ai_router, prefix="/ai", tags=["ai"])
\ No newline at end of file
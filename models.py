@@ -1,7 +1,7 @@
 from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Date
 from sqlalchemy.dialects.postgresql import JSONB
 from database import Base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 class DBUser(Base):
     __tablename__ = "users"
@@ -18,6 +18,9 @@ class Org(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
+    # Bumped by DB triggers on every employees write (see add_org_data_version.py); used for listing ETags.
+    # Deferred so loading an Org never depends on the column having been migrated.
+    data_version = deferred(Column(Integer, nullable=False, default=0, server_default="0"))
 
 class HR(Base):
     __tablename__ = "hr_users"
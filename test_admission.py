@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import FairAdmissionController, parse_org_weights
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_parse_org_weights():
+    assert parse_org_weights("") == {}
+    assert parse_org_weights("1:2, 7:0.5") == {1: 2.0, 7: 0.5}
+
+
+@pytest.mark.parametrize("raw", ["1:0", "1:-2", "1:nan", "1", "a:2", "1:2:3"])
+def test_parse_org_weights_rejects_bad_entries(raw):
+    with pytest.raises(RuntimeError):
+        parse_org_weights(raw)
+
+
+def test_orgs_are_interleaved_fairly():
+    async def scenario():
+        controller = FairAdmissionController(1, 20, 10, 5)
+        order = []
+
+        async def job(org_id):
+            async with controller.slot(org_id):
+                order.append(org_id)
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.create_task(job(1)) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(job(2)) for _ in range(2)]
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == [1, 1, 2, 1, 2, 1, 1]
+
+
+def test_full_queue_returns_429_with_retry_after():
+    async def scenario():
+        controller = FairAdmissionController(1, 1, 1, 2)
+        await controller.acquire(1)
+        waiter = asyncio.create_task(controller.acquire(2))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc_info:
+            async with controller.slot(3):
+                pass
+        controller.release()
+        await waiter
+        controller.release()
+        return exc_info.value, controller.metrics()
+
+    exc, metrics = run(scenario())
+    assert exc.status_code == 429
+    assert exc.headers["Retry-After"] == "2"
+    assert metrics["rejected_queue_full_total"] == 1
+    assert metrics["active"] == 0
+
+
+def test_timed_out_waiter_is_refunded_and_recorded():
+    async def scenario():
+        controller = FairAdmissionController(1, 10, 10, 0.05)
+        await controller.acquire(1)
+        with pytest.raises(HTTPException):
+            async with controller.slot(2):
+                pass
+        controller.release()
+        return controller
+
+    controller = run(scenario())
+    # Org 2 is not charged for the request that never ran
+    assert controller._last_finish[2] == 0.0
+    metrics = controller.metrics(org_id=2)
+    assert metrics["rejected_timeout_total"] == 1
+    assert metrics["abandoned_wait_total"] == 1
+    assert metrics["abandoned_wait_seconds_avg"] >= 0.05
+    assert metrics["org_queue_depth"] == 0
+    assert "queue_depth_by_org" not in metrics